@@ -1,58 +1,266 @@
 import cv2
+import importlib.util
+import numpy as np
+import os
+import sys
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, Response, jsonify
 from flask_cors import CORS
 
-# 物体検出ライブラリのインポートは初回有効化時まで遅延
-OBJECT_DETECTION_AVAILABLE = None  # None: 未確認, True: 利用可能, False: 利用不可
+# 小さなフレームに対するimencode/resizeではOpenCV内部のスレッド起動コストが処理時間を上回るため、
+# OpenCVはシングルスレッドで動かし、並列化はキャプチャ・推論・エンコードのパイプラインで行う
+cv2.setNumThreads(1)
+cv2.ocl.setUseOpenCL(False)
+
+# CPU_AFFINITY="0,1,2,3" のように指定すると、ストリーミング処理を指定コア（Pコア等）に固定する（Linuxのみ）。
+# 起動時に設定することで、以降に生成されるスレッドにも引き継がれる
+if os.getenv('CPU_AFFINITY') and hasattr(os, 'sched_setaffinity'):
+    try:
+        os.sched_setaffinity(0, {int(cpu) for cpu in os.getenv('CPU_AFFINITY').split(',')})
+    except (ValueError, OSError) as e:
+        print(f"CPUアフィニティの設定に失敗しました: {e}")
+
+# 物体検出ライブラリの有無は起動時にインストール状況だけを確認し、インポートはモデル読み込み時まで遅延
+# （find_specはtorch等の重いインポートを伴わない）
+OBJECT_DETECTION_AVAILABLE = importlib.util.find_spec('ultralytics') is not None
 YOLO = None
 
+# GPU JPEGエンコーダー（nvJPEG）も初回エンコード時まで遅延して確認
+NVJPEG_AVAILABLE = None  # None: 未確認, True: 利用可能, False: 利用不可
+nvjpeg_encoder = None
+nvjpeg_lock = threading.Lock()
+
+# 物体検出無効時にカメラのMJPEGをそのまま配信する高速経路（Linux + v4l2pyでのみ利用）
+RAW_STREAM_AVAILABLE = sys.platform.startswith('linux') and importlib.util.find_spec('v4l2py') is not None
+# v4l2pyでデバイスを使用中の間保持するロック（OpenCVと同時にデバイスを開かないため）
+raw_device_lock = threading.Lock()
+# 高速経路でデバイスを開いてから最初のJPEGを待つ時間（秒）。届かなければ通常経路を使う
+RAW_FIRST_FRAME_TIMEOUT = 1.0
+# 高速経路で複数の配信が共有するワーカー
+raw_camera_worker = None
+raw_camera_lock = threading.Lock()
+
+# JPEGエンコード品質
+JPEG_QUALITY = 80
+
+# MJPEGチャンクのヘッダー・トレーラー（フレーム毎のバイト列生成を避けるため定数化）
+_HDR = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+_TRL = b'\r\n'
+
+# 停止中に返す黒画像のMJPEGチャンク（リクエスト毎のエンコードを避けるため起動時に一度だけ生成）
+_BLACK = np.zeros((480, 640, 3), np.uint8)
+_BLACK_JPEG = cv2.imencode('.jpg', _BLACK)[1].tobytes()
+_BLACK_CHUNK = b''.join((_HDR, _BLACK_JPEG, _TRL))
+
 app = Flask(__name__)
 CORS(app)  # CORSを有効にしてフロントエンドからのアクセスを許可
 
 # グローバル変数
 camera = None
+camera_worker = None
 camera_lock = threading.Lock()
-is_streaming = False
 object_detection_model = None
-object_detection_enabled = False
+# モデルの読み込み中にセットされる（起動時の事前読み込み・リクエストからの読み込みの両方）
+model_loading = threading.Event()
+model_loading_lock = threading.Lock()
+# モデルの読み込み・変換を同時に1つだけ実行するためのロック
+model_init_lock = threading.Lock()
+# ストリーミング中・物体検出有効の状態（スレッド間で安全に参照・変更するためEventで保持）
+STREAM_EVENT = threading.Event()
+DETECT_EVENT = threading.Event()
+
+# 物体検出時に一度の推論でまとめて処理するフレーム数
+BATCH_SIZE = int(os.getenv('YOLO_BATCH_SIZE', '4'))
+# 物体検出モデルの入力サイズ（長辺）
+MODEL_IMGSZ = 640
+
+# カメラのキャプチャ設定
+CAMERA_INDEX = 0
+CAMERA_WIDTH = 640
+CAMERA_HEIGHT = 480
+CAMERA_FPS = 30
+# 自動露出が安定するまで読み捨てるフレーム数
+CAMERA_WARMUP_FRAMES = 5
+
+# 配信フレームレートの上限（0なら上限なし。通常はカメラの読み込みがペースを決める）
+STREAM_MAX_FPS = float(os.getenv('STREAM_MAX_FPS', '0'))
+
+# 検出結果の描画に使うクラス毎の色（BGR）。隣接クラスの色相が離れるよう起動時に一度だけ生成
+_NUM_COLORS = 80
+_hsv = np.zeros((1, _NUM_COLORS, 3), np.uint8)
+_hsv[0, :, 0] = np.arange(_NUM_COLORS) * 37 % 180
+_hsv[0, :, 1:] = 255
+COLOR_LUT = [tuple(int(c) for c in bgr) for bgr in cv2.cvtColor(_hsv, cv2.COLOR_HSV2BGR)[0]]
+
+# これより古いフレームは推論・エンコードせずに破棄する（秒）
+MAX_FRAME_AGE = 0.08
+
+# ストリーミングの統計情報（/stream_statsで公開）
+stream_stats = {'frames_processed': 0, 'frames_skipped': 0, 'frames_dropped_stale': 0}
+stream_stats_lock = threading.Lock()
 
 def check_ultralytics_availability():
-    """ultralyticsの利用可能性を確認し、必要に応じてインポートする。"""
-    global OBJECT_DETECTION_AVAILABLE, YOLO
-    
-    if OBJECT_DETECTION_AVAILABLE is not None:
-        return OBJECT_DETECTION_AVAILABLE
-    
-    print("ultralyticsの利用可能性を確認中...")
+    """ultralyticsの利用可能性を返す（起動時に確認済みの値）。"""
+    return OBJECT_DETECTION_AVAILABLE
+
+def check_nvjpeg_availability():
+    """nvJPEG（PyNvJpeg）の利用可能性を確認し、利用可能ならエンコーダーを初期化する。"""
+    global NVJPEG_AVAILABLE, nvjpeg_encoder
+
+    if NVJPEG_AVAILABLE is not None:
+        return NVJPEG_AVAILABLE
+
     try:
-        from ultralytics import YOLO
-        OBJECT_DETECTION_AVAILABLE = True
-        print("ultralyticsが利用可能です。")
+        from nvjpeg import NvJpeg
+        nvjpeg_encoder = NvJpeg()
+        NVJPEG_AVAILABLE = True
+        print("nvJPEGが利用可能です。JPEGエンコードにGPUを使用します。")
+    except Exception as e:
+        # ImportErrorに加え、CUDAデバイスが無い場合の初期化失敗もCPUにフォールバック
+        print(f"nvJPEGが利用できないため、CPUでJPEGエンコードを行います: {e}")
+        nvjpeg_encoder = None
+        NVJPEG_AVAILABLE = False
+    return NVJPEG_AVAILABLE
+
+def encode_jpeg(frame):
+    """BGRフレームをJPEGにエンコードし、バッファプロトコル対応のオブジェクトを返す。失敗時はNone。
+
+    nvJPEGが利用可能ならGPUで、そうでなければOpenCVでCPUエンコードする。
+    CPUエンコード時はimencodeの出力配列をコピーせずにそのまま返す。
+    """
+    if check_nvjpeg_availability():
+        try:
+            # nvJPEGのハンドルはスレッドセーフではないため排他して使用する
+            with nvjpeg_lock:
+                return nvjpeg_encoder.encode(frame, JPEG_QUALITY)
+        except Exception as e:
+            print(f"nvJPEGエンコードエラー（CPUエンコードで再試行します）: {e}")
+
+    ret, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY,
+                                               cv2.IMWRITE_JPEG_OPTIMIZE, 0])
+    if not ret:
+        return None
+    return buffer
+
+def _warmup_model(model):
+    """ダミー入力で一度推論し、バックエンドの読み込みやCUDAカーネルの準備を初回フレームより前に済ませる。
+
+    TensorRT/OpenVINOのモデルは初回推論時に読み込まれるため、読み込めるかどうかの確認も兼ねる。
+    """
+    dummy = np.zeros((MODEL_IMGSZ, MODEL_IMGSZ, 3), np.uint8)
+    model([dummy] * BATCH_SIZE, imgsz=MODEL_IMGSZ, verbose=False)
+    return model
+
+def _mark_export_failed(failed_marker, error):
+    """変換済みモデルが使えないことを記録し、次回以降の起動で変換・読み込みを試みないようにする。"""
+    try:
+        with open(failed_marker, 'w', encoding='utf-8') as f:
+            f.write(str(error))
+    except OSError:
+        pass
+
+def _load_optimized_model(model_path):
+    """推論用に最適化したモデルを読み込み、ウォームアップ済みの状態で返す。
+
+    CUDAが利用可能ならFP16のTensorRTエンジン、そうでなければOpenVINOモデルに
+    初回のみ変換してキャッシュし、次回以降は変換済みのモデルを直接読み込む。
+    変換先のランタイムが未インストールの場合や、変換・推論に失敗した場合は
+    元の.ptモデルをそのまま使用する。
+    """
+    import torch
+
+    base_path = os.path.splitext(model_path)[0]
+    # エンジンの最大バッチ数はBATCH_SIZEで固定されるため、キャッシュ名に含めて変更時は作り直す
+    if torch.cuda.is_available():
+        runtime = 'tensorrt'
+        cached_path = f"{base_path}_b{BATCH_SIZE}.engine"
+        export_args = {'format': 'engine', 'half': True}
+    else:
+        runtime = 'openvino'
+        cached_path = f"{base_path}_b{BATCH_SIZE}_openvino_model"
+        export_args = {'format': 'openvino', 'half': True}
+    # 変換・読み込みに失敗したことを記録し、起動毎に失敗する処理を繰り返さないためのマーカー
+    failed_marker = cached_path + '.failed'
+
+    if os.path.exists(failed_marker):
+        print(f"変換済みモデルが使用できないため、元のモデルを使用します"
+              f"（{cached_path}と{failed_marker}を削除すると再変換します）")
+        return _warmup_model(YOLO(model_path))
+
+    if os.path.exists(cached_path):
+        try:
+            print(f"変換済みモデルを読み込みます: {cached_path}")
+            return _warmup_model(YOLO(cached_path, task='detect'))
+        except Exception as e:
+            # ランタイムやドライバの更新、別GPUで作成されたエンジン等は初回推論で失敗する
+            print(f"変換済みモデルで推論できないため、元のモデルを使用します: {e}")
+            _mark_export_failed(failed_marker, e)
+            return _warmup_model(YOLO(model_path))
+
+    if importlib.util.find_spec(runtime) is None:
+        print(f"{runtime}がインストールされていないため、元のモデルを使用します")
+        return _warmup_model(YOLO(model_path))
+
+    try:
+        print(f"モデルを{export_args['format']}形式に変換しています（初回のみ）...")
+        # 停止時の端数バッチも推論できるよう、バッチサイズはBATCH_SIZEを上限とした動的形状にする
+        exported_path = YOLO(model_path).export(dynamic=True, batch=BATCH_SIZE, imgsz=MODEL_IMGSZ, **export_args)
+        # 変換が最後まで完了した場合のみキャッシュ名に移動し、中断された変換結果を読み込まないようにする
+        os.replace(os.path.normpath(exported_path), cached_path)
+        model = _warmup_model(YOLO(cached_path, task='detect'))
+        print(f"モデルの変換が完了しました: {cached_path}")
+        return model
+    except Exception as e:
+        print(f"モデルの変換または変換後の推論に失敗したため、元のモデルを使用します: {e}")
+        _mark_export_failed(failed_marker, e)
+        return _warmup_model(YOLO(model_path))
+
+def _begin_model_loading():
+    """モデルの読み込み開始を登録する。既に読み込み中ならFalseを返す。"""
+    with model_loading_lock:
+        if model_loading.is_set():
+            return False
+        model_loading.set()
         return True
-    except ImportError:
-        print("ultralyticsがインストールされていません。物体検出機能は無効になります。")
-        OBJECT_DETECTION_AVAILABLE = False
-        YOLO = None
-        return False
 
 def initialize_object_detection_model():
     """物体検出モデルを初期化する。"""
-    global object_detection_model
+    # 同じキャッシュファイルへの変換が並行して走らないよう、読み込みは1つずつ行う
+    with model_init_lock:
+        if object_detection_model is not None:
+            return True
+        return _initialize_object_detection_model()
+
+def _initialize_object_detection_model():
+    """物体検出モデルを読み込む。model_init_lockを保持した状態で呼び出す。"""
+    global object_detection_model, OBJECT_DETECTION_AVAILABLE, YOLO
     
     # まずultralyticsの利用可能性を確認
     if not check_ultralytics_availability():
         print("ultralyticsが利用できません。物体検出機能は無効です。")
         return False
     
+    if YOLO is None:
+        print("ultralyticsをインポートしています...")
+        # モデル変換時などにultralyticsが不足パッケージを自動でpip installしないようにする
+        os.environ.setdefault('YOLO_AUTOINSTALL', 'False')
+        try:
+            from ultralytics import YOLO
+        except ImportError as e:
+            print(f"ultralyticsのインポートに失敗しました。物体検出機能は無効になります: {e}")
+            OBJECT_DETECTION_AVAILABLE = False
+            return False
+    
     try:
         print("物体検出モデルの読み込みを開始しています...")
         model_path = 'models/yolo11n.pt'
         print(f"モデルファイル: {model_path}")
         
-        # モデル読み込み（時間がかかる処理）
-        object_detection_model = YOLO(model_path)
+        # モデル読み込み（時間がかかる処理）。ウォームアップ済みのモデルが返る
+        object_detection_model = _load_optimized_model(model_path)
         print(f"物体検出モデルを正常に読み込みました: {model_path}")
         return True
     except Exception as e:
@@ -60,70 +268,558 @@ def initialize_object_detection_model():
         object_detection_model = None
         return False
 
+def _preload_object_detection_model():
+    """物体検出モデルをバックグラウンドで事前に読み込む。"""
+    try:
+        initialize_object_detection_model()
+    finally:
+        model_loading.clear()
+
+# PRELOAD_YOLO=1 の場合、初回の物体検出有効化を待たせないよう起動時にモデルを読み込む
+if os.getenv('PRELOAD_YOLO') == '1' and check_ultralytics_availability() and _begin_model_loading():
+    threading.Thread(target=_preload_object_detection_model, daemon=True).start()
+
+class CameraWorker(threading.Thread):
+    """カメラから常に最新フレームを読み込み続けるプロデューサースレッド。
+
+    推論やエンコードの遅延がキャプチャを止めないよう、読み込んだフレームは
+    最新の1枚だけを公開し、古いフレームは上書きして捨てる。
+    フレームは事前確保したリングバッファに直接読み込み、公開中・読み出し中の
+    バッファを避けて書き込むことで、フレーム毎の確保とコピーを行わない。
+    読み出し中のバッファはコンシューマー毎に管理し、複数の配信が同時に動作しても
+    使用中のバッファは上書きしない（空きが無ければバッファを追加する）。
+    """
+
+    NUM_BUFFERS = 3  # バッファの初期数（公開中 + 書き込み中 + コンシューマー1つ分）
+
+    def __init__(self, cap):
+        super().__init__(daemon=True)
+        self.cap = cap
+        self.latest_ts = 0.0
+        self.seq = 0
+        self._bufs = [np.empty((CAMERA_HEIGHT, CAMERA_WIDTH, 3), np.uint8)
+                      for _ in range(self.NUM_BUFFERS)]
+        self._published = -1  # コンシューマーに公開中のバッファ番号
+        self._held = {}       # コンシューマー毎の使用中のバッファ番号
+        self._cond = threading.Condition()
+        self._running = True
+
+    def run(self):
+        while self._running:
+            # ストリーミング停止中は読み込みを休止する（停止要求を確認するため定期的に起きる）
+            if not STREAM_EVENT.wait(timeout=0.1):
+                continue
+            with self._cond:
+                busy = set(self._held.values())
+                busy.add(self._published)
+                idx = next((i for i in range(len(self._bufs)) if i not in busy), None)
+                if idx is None:
+                    # コンシューマーが増えて空きが無い場合のみバッファを追加する
+                    self._bufs.append(np.empty_like(self._bufs[0]))
+                    idx = len(self._bufs) - 1
+
+            # 解像度がバッファと異なる場合、OpenCVは新しい配列を確保して返す
+            ret, frame = self.cap.read(self._bufs[idx])
+            with self._cond:
+                if not ret:
+                    print("カメラからフレームを読み込めませんでした")
+                    self._running = False
+                    self._cond.notify_all()
+                    break
+                self._bufs[idx] = frame
+                self._published = idx
+                self.latest_ts = time.monotonic()
+                self.seq += 1
+                self._cond.notify_all()
+
+    def get_latest(self, last_seq, reader, timeout=1.0):
+        """last_seqより新しいフレームを待って (frame, seq, timestamp) を返す。
+
+        readerはコンシューマーを識別する任意のキー。返したフレームのバッファは
+        同じreaderで次に呼び出すか、releaseするまで上書きされない。
+        タイムアウト時やカメラ停止時はframeにNoneを返す（停止はrunningで判別する）。
+        """
+        with self._cond:
+            # 前回返したバッファは使用済みとして解放する
+            self._held.pop(reader, None)
+            # ストリーミング停止時はwakeで起こされ、新しいフレームを待たずに戻る
+            self._cond.wait_for(lambda: (self.seq != last_seq or not self._running
+                                         or not STREAM_EVENT.is_set()), timeout)
+            if not self._running or not STREAM_EVENT.is_set() or self.seq == last_seq:
+                return None, self.seq, 0.0
+            self._held[reader] = self._published
+            return self._bufs[self._published], self.seq, self.latest_ts
+
+    def release(self, reader):
+        """readerが使用中のバッファを解放する。配信の終了時に呼び出す。"""
+        with self._cond:
+            self._held.pop(reader, None)
+
+    @property
+    def running(self):
+        """読み込みループが動作中かどうか。"""
+        return self._running
+
+    def wake(self):
+        """get_latestで待機中のコンシューマーを起こし、状態を再確認させる。"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def stop(self):
+        """読み込みループを停止し、スレッドの終了を待つ。"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout=1.0)
+
+def _open_capture():
+    """キャプチャ設定を適用したVideoCaptureを開く。"""
+    # LinuxではV4L2を直接使い、ドライバ任せの色空間変換を避ける
+    backend = cv2.CAP_V4L2 if sys.platform.startswith('linux') else cv2.CAP_ANY
+    cap = cv2.VideoCapture(CAMERA_INDEX, backend)
+    if not cap.isOpened():
+        return cap
+
+    # MJPGで受け取ることでUSB帯域とYUYV→BGR変換のCPU負荷を抑える
+    cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_WIDTH)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_HEIGHT)
+    cap.set(cv2.CAP_PROP_FPS, CAMERA_FPS)
+    # ドライバ側に古いフレームを溜めない
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
 def get_camera():
-    """カメラオブジェクトを取得する。見つからなければNoneを返す。"""
-    global camera
+    """カメラのワーカースレッドを取得する。見つからなければNoneを返す。"""
+    global camera, camera_worker
     with camera_lock:
+        # 読み込みに失敗して停止したワーカーは破棄して開き直す
+        if camera_worker is not None and not camera_worker.is_alive():
+            camera_worker = None
+            camera.release()
+            camera = None
         if camera is None:
-            camera = cv2.VideoCapture(0)
+            # 高速経路がデバイスを解放するまで待つ
+            if not raw_device_lock.acquire(timeout=1.0):
+                print("カメラが他の配信で使用中のため開けませんでした")
+                return None
+            try:
+                camera = _open_capture()
+            finally:
+                raw_device_lock.release()
             if not camera.isOpened():
                 print("カメラを開けませんでした")
                 camera = None
-        return camera
+                return None
+            for _ in range(CAMERA_WARMUP_FRAMES):
+                camera.read()
+            camera_worker = CameraWorker(camera)
+            camera_worker.start()
+        return camera_worker
 
 def release_camera():
     """カメラリソースを解放する。"""
-    global camera
+    global camera, camera_worker
     with camera_lock:
+        if camera_worker is not None:
+            camera_worker.stop()
+            camera_worker = None
         if camera is not None:
             camera.release()
             camera = None
 
+def _wake_stream_consumers():
+    """フレーム待ちのジェネレータを起こし、ストリーミング・物体検出の状態変化を即座に反映させる。"""
+    with camera_lock:
+        worker = camera_worker
+    if worker is not None:
+        worker.wake()
+    with raw_camera_lock:
+        raw_worker = raw_camera_worker
+    if raw_worker is not None:
+        raw_worker.wake()
+
+def _warmup_camera():
+    """カメラを事前に開き、最初のストリーミング要求を待たせないようにする。"""
+    if get_camera() is not None:
+        print("カメラの準備が完了しました")
+
+# V4L2のネゴシエーション等で初回の/video_feedが遅れないよう、起動時にバックグラウンドでカメラを開く。
+# 高速経路が使える環境では初回配信はv4l2pyで開き直すため、OpenCVでの事前オープンは行わない
+if not RAW_STREAM_AVAILABLE:
+    threading.Thread(target=_warmup_camera, daemon=True).start()
+
+def _encode_frame_chunk(frame):
+    """フレームをJPEGにエンコードし、MJPEGのチャンクとして返す。失敗時はNone。"""
+    jpeg = encode_jpeg(frame)
+    if jpeg is None:
+        return None
+    # joinはバッファプロトコルを直接受け付けるため、JPEGのコピーはここでの1回だけになる
+    return b''.join((_HDR, jpeg, _TRL))
+
+def _draw_detections(frame, result):
+    """推論結果のバウンディングボックスとラベルをフレームに直接描画する。"""
+    boxes = result.boxes
+    if len(boxes) == 0:
+        return
+
+    # GPU上の検出結果は (x1, y1, x2, y2, conf, cls) の1テンソルのままホストへ1回だけ転送する
+    data = boxes.data.cpu().numpy()
+    xyxy = data[:, :4].astype(np.int32)
+    conf = data[:, -2]
+    cls = data[:, -1].astype(np.int32)
+
+    for (x1, y1, x2, y2), c, score in zip(xyxy, cls, conf):
+        color = COLOR_LUT[c % _NUM_COLORS]
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, f"{result.names[c]} {score:.2f}", (x1, max(y1 - 5, 12)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+
+def _run_batch_inference(batch):
+    """バッファに溜めたフレームをまとめて推論し、描画済みフレームを順に返す。"""
+    frames = list(batch)
+    batch.clear()
+    try:
+        # 複数フレームを一度に推論することでGPUのカーネル起動コストを償却する
+        results = object_detection_model(frames, imgsz=MODEL_IMGSZ, verbose=False)
+        # results[0].plot()はフレーム毎にAnnotatorを生成するため、入力フレームへ直接描画する
+        for frame, result in zip(frames, results):
+            _draw_detections(frame, result)
+        return frames
+    except Exception as e:
+        print(f"物体検出推論エラー: {e}")
+        return frames
+
+def _copy_for_inference(frame, buf):
+    """フレームを長辺がMODEL_IMGSZ以下になるよう縮小してbufに書き込み、書き込んだバッファを返す。
+
+    bufの形状が合わない場合は新たに確保する。縮小不要なら単にコピーする。
+    """
+    height, width = frame.shape[:2]
+    scale = MODEL_IMGSZ / max(height, width)
+    if scale < 1.0:
+        size = (round(width * scale), round(height * scale))
+        shape = (size[1], size[0], frame.shape[2])
+    else:
+        shape = frame.shape
+
+    if buf is None or buf.shape != shape:
+        buf = np.empty(shape, frame.dtype)
+    if scale < 1.0:
+        # 推論側でのレターボックス前の縮小処理を省き、転送量も減らす
+        cv2.resize(frame, size, dst=buf, interpolation=cv2.INTER_AREA)
+    else:
+        np.copyto(buf, frame)
+    return buf
+
+# JPEGエンコード用スレッドプール（cv2のエンコードはGILを解放するため次フレームの推論と並行できる）
+encoder_pool = ThreadPoolExecutor(max_workers=2)
+
+class PipelinedEncoder:
+    """フレームのエンコードをスレッドプールで行い、1フレーム遅れでMJPEGチャンクを返す。
+
+    エンコード中のフレームが呼び出し元で上書きされないよう、2面の作業バッファに
+    交互にコピーしてから投入する。パイプラインの深さは1に固定し、メモリ使用量を抑える。
+    """
+
+    def __init__(self):
+        self._pending = None
+        self._staging = [None, None]
+        self._next = 0
+
+    def submit(self, frame):
+        """フレームのエンコードを投入し、1つ前のフレームのチャンクを返す（無ければNone）。"""
+        # このバッファを使った2つ前のエンコードは、前回のsubmitで完了を待ち済み
+        buf = self._staging[self._next]
+        if buf is None or buf.shape != frame.shape:
+            buf = self._staging[self._next] = np.empty_like(frame)
+        np.copyto(buf, frame)
+        self._next ^= 1
+
+        previous, self._pending = self._pending, encoder_pool.submit(_encode_frame_chunk, buf)
+        return previous.result() if previous is not None else None
+
+    def flush(self):
+        """投入済みで未取得のチャンクを返す（無ければNone）。"""
+        previous, self._pending = self._pending, None
+        return previous.result() if previous is not None else None
+
+def _wait_next_tick(next_tick, fps=STREAM_MAX_FPS):
+    """fps（既定はSTREAM_MAX_FPS）に合わせて送出時刻まで待ち、次の送出時刻を返す。"""
+    if fps <= 0:
+        return next_tick
+    now = time.monotonic()
+    if next_tick > now:
+        time.sleep(next_tick - now)
+        now = next_tick
+    return now + 1.0 / fps
+
 def generate_frames():
     """カメラフレームを生成するジェネレータ。"""
-    global is_streaming, object_detection_model, object_detection_enabled
+    global object_detection_model
+
+    batch = deque(maxlen=BATCH_SIZE)
+    # カメラのリングバッファは次のフレーム取得後に上書きされるため、バッチ用の領域を別に確保して再利用する
+    batch_bufs = [None] * BATCH_SIZE
+    encoder = PipelinedEncoder()
+    last_seq = 0
+    next_tick = 0.0
+
+    # ワーカーが停止（カメラ解放や高速経路への切り替え）したらストリームを終了する
+    worker = get_camera()
+    if worker is None:
+        return
+
+    # まとめて推論した結果はカメラの撮影間隔で送出し、ブラウザに一度に届いて間引かれないようにする
+    batch_fps = STREAM_MAX_FPS if STREAM_MAX_FPS > 0 else CAMERA_FPS
+
+    def emit_batch(frames):
+        """推論済みのバッチを撮影間隔で送出し、最後のフレームも次のバッチを待たずに送り切る。"""
+        nonlocal next_tick
+        for output_frame in frames:
+            chunk = encoder.submit(output_frame)
+            if chunk is not None:
+                next_tick = _wait_next_tick(next_tick, batch_fps)
+                yield chunk
+        chunk = encoder.flush()
+        if chunk is not None:
+            next_tick = _wait_next_tick(next_tick, batch_fps)
+            yield chunk
+
+    # このジェネレータが使用中のリングバッファを識別するキー
+    reader = object()
+    try:
+        while STREAM_EVENT.is_set():
+            # 常に最新のフレームだけを取り出し、処理中に届いた古いフレームは捨てる
+            frame, seq, frame_ts = worker.get_latest(last_seq, reader)
+            if frame is None:
+                if not worker.running:
+                    break
+                continue
+            skipped = seq - last_seq - 1 if last_seq else 0
+            last_seq = seq
+
+            # 推論が追いつかず古くなったフレームはリアルタイム性を優先して破棄
+            is_stale = time.monotonic() - frame_ts > MAX_FRAME_AGE
+            with stream_stats_lock:
+                stream_stats['frames_skipped'] += skipped
+                if is_stale:
+                    stream_stats['frames_dropped_stale'] += 1
+                else:
+                    stream_stats['frames_processed'] += 1
+            if is_stale:
+                continue
+
+            # 物体検出が有効な場合、BATCH_SIZE枚溜まってからまとめて推論を実行
+            if DETECT_EVENT.is_set() and object_detection_model is not None:
+                buf = _copy_for_inference(frame, batch_bufs[len(batch)])
+                batch_bufs[len(batch)] = buf
+                batch.append(buf)
+                if len(batch) < BATCH_SIZE:
+                    continue
+                yield from emit_batch(_run_batch_inference(batch))
+                continue
+
+            # 物体検出を無効化した直後に残っているフレームは推論せずに送出
+            output_frames = list(batch) + [frame]
+            batch.clear()
+
+            # エンコードは次フレームの取得・推論と並行して進め、前フレームの結果を送出
+            for output_frame in output_frames:
+                chunk = encoder.submit(output_frame)
+                if chunk is not None:
+                    next_tick = _wait_next_tick(next_tick)
+                    yield chunk
+
+        # 停止時にバッファに残ったフレームは小さいバッチで推論して送出
+        if batch and object_detection_model is not None:
+            yield from emit_batch(_run_batch_inference(batch))
+
+        chunk = encoder.flush()
+        if chunk is not None:
+            yield chunk
+    finally:
+        worker.release(reader)
+
+class RawCameraWorker(threading.Thread):
+    """v4l2pyで読み込んだカメラのJPEGを、複数の配信で共有するプロデューサースレッド。
 
-    while is_streaming:
-        cap = get_camera()
-        if cap is None:
-            break
+    JPEGは変更されないbytesのため、コピーせずにそのまま各コンシューマーへ渡す。
+    スレッドの終了時にデバイスを閉じ、raw_device_lockを解放する。
+    """
 
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def __init__(self, device):
+        super().__init__(daemon=True)
+        self.device = device
+        self.latest = None
+        self.seq = 0
+        self.clients = 0  # このワーカーを使用中の配信数（raw_camera_lockで保護）
+        self._cond = threading.Condition()
+        self._running = True
 
-        # 物体検出が有効な場合、推論を実行
-        if object_detection_enabled and object_detection_model is not None:
+    def run(self):
+        try:
+            for frame in self.device:
+                with self._cond:
+                    if not self._running:
+                        break
+                    self.latest = frame.data
+                    self.seq += 1
+                    self._cond.notify_all()
+        except Exception as e:
+            print(f"v4l2pyでのフレーム読み込みに失敗しました: {e}")
+        finally:
+            with self._cond:
+                self._running = False
+                self._cond.notify_all()
             try:
-                # 物体検出推論を実行
-                results = object_detection_model(frame)
-                # 推論結果を画像に描画
-                frame = results[0].plot()
-            except Exception as e:
-                print(f"物体検出推論エラー: {e}")
-
-        # フレームをJPEGにエンコード
-        ret, buffer = cv2.imencode('.jpg', frame)
-        if ret:
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-
-        time.sleep(0.033)  # 約30FPS
+                self.device.close()
+            except Exception:
+                pass
+            raw_device_lock.release()
+
+    def wait_first_frame(self, timeout):
+        """最初のJPEGを受信するまで待ち、受信できたかどうかを返す。"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.seq > 0 or not self._running, timeout)
+            return self.seq > 0
+
+    def get_latest(self, last_seq, timeout=1.0):
+        """last_seqより新しいJPEGを待って (jpeg, seq) を返す。
+
+        タイムアウト時、停止時、物体検出の有効化時はjpegにNoneを返す。
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: (self.seq != last_seq or not self._running
+                                         or not STREAM_EVENT.is_set() or DETECT_EVENT.is_set()), timeout)
+            if (not self._running or not STREAM_EVENT.is_set() or DETECT_EVENT.is_set()
+                    or self.seq == last_seq):
+                return None, self.seq
+            return self.latest, self.seq
+
+    @property
+    def running(self):
+        """読み込みループが動作中かどうか。"""
+        return self._running
+
+    def wake(self):
+        """get_latestで待機中のコンシューマーを起こし、状態を再確認させる。"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def stop(self, force=False):
+        """読み込みループに停止を要求する。デバイスは実行中の読み込み完了後に閉じられる。
+
+        forceがTrueの場合、フレームが届かず読み込みが戻らないときはデバイスを閉じて中断させる。
+        """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if force and self.is_alive():
+            self.join(timeout=0.5)
+            if self.is_alive():
+                try:
+                    self.device.close()
+                except Exception:
+                    pass
+                self.join(timeout=0.5)
+
+def _start_raw_camera():
+    """v4l2pyでカメラをMJPEG形式で開き、ワーカーを起動する。開けなければNoneを返す。"""
+    # OpenCV側がデバイスを掴んでいると開けないため先に解放する
+    release_camera()
+    if not raw_device_lock.acquire(timeout=1.0):
+        print("カメラが他の配信で使用中のため、通常の配信経路を使用します")
+        return None
+
+    device = None
+    try:
+        from v4l2py import Device
+        device = Device.from_id(CAMERA_INDEX)
+        device.open()
+        device.video_capture.set_format(CAMERA_WIDTH, CAMERA_HEIGHT, 'MJPG')
+    except Exception as e:
+        print(f"v4l2pyでカメラを開けなかったため、通常の配信経路を使用します: {e}")
+        if device is not None:
+            try:
+                device.close()
+            except Exception:
+                pass
+        raw_device_lock.release()
+        return None
+
+    worker = RawCameraWorker(device)
+    worker.start()
+    return worker
+
+def get_raw_camera():
+    """高速経路のワーカーを取得し、使用中の配信として登録する。開けなければNoneを返す。
+
+    既に動作中のワーカーがあれば共有し、複数の配信が同時に映像を受け取れるようにする。
+    """
+    global raw_camera_worker
+    with raw_camera_lock:
+        worker = raw_camera_worker
+        if worker is None or not worker.running:
+            worker = raw_camera_worker = _start_raw_camera()
+            if worker is None:
+                return None
+            # デバイスは開けてもフレームを取得できない場合があるため、最初のJPEGを確認してから採用する
+            if not worker.wait_first_frame(RAW_FIRST_FRAME_TIMEOUT):
+                print("v4l2pyでフレームを取得できなかったため、通常の配信経路を使用します")
+                worker.stop(force=True)
+                raw_camera_worker = None
+                return None
+        worker.clients += 1
+        return worker
+
+def release_raw_camera(worker):
+    """配信の終了を登録し、使用中の配信が無くなったらワーカーを停止する。"""
+    global raw_camera_worker
+    with raw_camera_lock:
+        worker.clients -= 1
+        if worker.clients <= 0:
+            worker.stop()
+            if raw_camera_worker is worker:
+                raw_camera_worker = None
+
+def _raw_jpeg_generator(worker):
+    """カメラが出力したJPEGをデコード・再エンコードせずにそのまま送出するジェネレータ。"""
+    last_seq = 0
+    next_tick = 0.0
+    try:
+        # 停止時や物体検出の有効化時は終了し、最後の配信が抜けた時点でデバイスを通常経路へ明け渡す
+        while STREAM_EVENT.is_set() and not DETECT_EVENT.is_set():
+            jpeg, seq = worker.get_latest(last_seq)
+            if jpeg is None:
+                if not worker.running:
+                    break
+                continue
+            skipped = seq - last_seq - 1 if last_seq else 0
+            last_seq = seq
+
+            with stream_stats_lock:
+                stream_stats['frames_skipped'] += skipped
+                stream_stats['frames_processed'] += 1
+            next_tick = _wait_next_tick(next_tick)
+            yield b''.join((_HDR, jpeg, _TRL))
+    finally:
+        release_raw_camera(worker)
 
 @app.route('/video_feed')
 def video_feed():
     """カメラ映像のストリーミングエンドポイント。"""
-    global is_streaming
-
-    if not is_streaming:
+    if not STREAM_EVENT.is_set():
         # 停止中は黒い画像を返す
-        black_frame = cv2.imencode('.jpg', cv2.zeros((480, 640, 3), dtype='uint8'))[1].tobytes()
-        return Response(
-            (b'--frame\r\n'
-             b'Content-Type: image/jpeg\r\n\r\n' + black_frame + b'\r\n'),
-            mimetype='multipart/x-mixed-replace; boundary=frame'
-        )
+        return Response(_BLACK_CHUNK, mimetype='multipart/x-mixed-replace; boundary=frame')
+
+    # 物体検出が無効なら推論のためのデコードは不要なため、カメラのJPEGをそのまま配信する
+    if RAW_STREAM_AVAILABLE and not DETECT_EVENT.is_set():
+        worker = get_raw_camera()
+        if worker is not None:
+            return Response(_raw_jpeg_generator(worker),
+                            mimetype='multipart/x-mixed-replace; boundary=frame')
 
     return Response(generate_frames(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
@@ -131,10 +827,8 @@ def video_feed():
 @app.route('/start_stream', methods=['POST'])
 def start_stream():
     """ストリーミングを開始する。"""
-    global is_streaming
-
-    if not is_streaming:
-        is_streaming = True
+    if not STREAM_EVENT.is_set():
+        STREAM_EVENT.set()
         return jsonify({'status': 'started'})
     else:
         return jsonify({'status': 'already_streaming'})
@@ -142,10 +836,9 @@ def start_stream():
 @app.route('/stop_stream', methods=['POST'])
 def stop_stream():
     """ストリーミングを停止する。"""
-    global is_streaming
-
-    if is_streaming:
-        is_streaming = False
+    if STREAM_EVENT.is_set():
+        STREAM_EVENT.clear()
+        _wake_stream_consumers()
         return jsonify({'status': 'stopped'})
     else:
         return jsonify({'status': 'already_stopped'})
@@ -153,32 +846,38 @@ def stop_stream():
 @app.route('/enable_object_detection', methods=['POST'])
 def enable_object_detection():
     """物体検出を有効にする。"""
-    global object_detection_enabled, object_detection_model
+    global object_detection_model
     
-    # 初回有効化時にultralyticsの利用可能性を確認
     if not check_ultralytics_availability():
         return jsonify({'status': 'error', 'message': 'ultralyticsがインストールされていません'})
     
     if object_detection_model is None:
+        # 他の読み込み（事前読み込みや別のリクエスト）が進行中なら、完了後の再要求を促す
+        if not _begin_model_loading():
+            return jsonify({'status': 'loading', 'message': '物体検出モデルを読み込み中です'}), 202
         print("物体検出モデルが未初期化のため、初期化を開始します...")
-        if initialize_object_detection_model():
-            object_detection_enabled = True
+        try:
+            initialized = initialize_object_detection_model()
+        finally:
+            model_loading.clear()
+        if initialized:
+            DETECT_EVENT.set()
+            _wake_stream_consumers()
             print("物体検出が有効になりました")
             return jsonify({'status': 'enabled', 'message': '物体検出を有効にしました（モデル読み込み完了）'})
         else:
             print("物体検出モデルの初期化に失敗しました")
             return jsonify({'status': 'error', 'message': '物体検出モデルの読み込みに失敗しました'})
     else:
-        object_detection_enabled = True
+        DETECT_EVENT.set()
+        _wake_stream_consumers()
         print("物体検出が有効になりました（モデルは既に読み込み済み）")
         return jsonify({'status': 'enabled', 'message': '物体検出を有効にしました'})
 
 @app.route('/disable_object_detection', methods=['POST'])
 def disable_object_detection():
     """物体検出を無効にする。"""
-    global object_detection_enabled
-    
-    object_detection_enabled = False
+    DETECT_EVENT.clear()
     return jsonify({'status': 'disabled', 'message': '物体検出を無効にしました'})
 
 @app.route('/health', methods=['GET'])
@@ -186,25 +885,34 @@ def health():
     """ヘルスチェックエンドポイント。"""
     return jsonify({
         'status': 'healthy',
-        'object_detection_available': OBJECT_DETECTION_AVAILABLE if OBJECT_DETECTION_AVAILABLE is not None else False,
-        'streaming': is_streaming
+        'object_detection_available': OBJECT_DETECTION_AVAILABLE,
+        'streaming': STREAM_EVENT.is_set()
     })
 
+@app.route('/stream_stats', methods=['GET'])
+def stream_stats_endpoint():
+    """フレームの処理数・破棄数などストリーミングの統計情報を取得する。"""
+    with stream_stats_lock:
+        stats = dict(stream_stats)
+
+    total = stats['frames_processed'] + stats['frames_skipped'] + stats['frames_dropped_stale']
+    dropped = stats['frames_skipped'] + stats['frames_dropped_stale']
+    stats['drop_rate'] = dropped / total if total else 0.0
+    stats['batch_size'] = BATCH_SIZE
+    stats['max_frame_age_ms'] = MAX_FRAME_AGE * 1000
+    return jsonify(stats)
+
 @app.route('/object_detection_status', methods=['GET'])
 def object_detection_status():
     """物体検出の状態を取得する。"""
-    global object_detection_enabled, object_detection_model
-    
-    # 初回状態確認時にultralyticsの利用可能性を確認
-    if OBJECT_DETECTION_AVAILABLE is None:
-        check_ultralytics_availability()
+    global object_detection_model
     
+    # フロントエンドから頻繁に呼ばれるため、確認済みの値を返すだけにする
     status = {
-        'available': OBJECT_DETECTION_AVAILABLE if OBJECT_DETECTION_AVAILABLE is not None else False,
-        'enabled': object_detection_enabled,
+        'available': OBJECT_DETECTION_AVAILABLE,
+        'enabled': DETECT_EVENT.is_set(),
         'model_loaded': object_detection_model is not None
     }
-    print(f"物体検出状態を返します: {status}")
     return jsonify(status)
 
 if __name__ == '__main__':
@@ -213,11 +921,21 @@ if __name__ == '__main__':
         print("フロントエンドから http://localhost:5000 にアクセスしてください")
         
         # ultralyticsのインポートは初回有効化時まで遅延
-        print("ultralyticsのインポートは初回物体検出有効化時まで遅延されます。")
+        print(f"ultralytics: {'利用可能' if OBJECT_DETECTION_AVAILABLE else '未インストール'}"
+              "（インポートは初回物体検出有効化時まで遅延されます）")
         
-        app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
+        # 本番用WSGIサーバー（ワーカー1プロセス・複数スレッド）で起動する。
+        # Windows向けexeでも動作し、ストリーミング中も制御用のPOSTを並行して処理できる
+        try:
+            from waitress import serve
+        except ImportError:
+            print("waitressがインストールされていないため、Flask組み込みサーバーで起動します。")
+            app.run(host='0.0.0.0', port=5000, threaded=True)
+        else:
+            serve(app, host='0.0.0.0', port=5000, threads=8)
     except KeyboardInterrupt:
         print("サーバーを停止しています...")
     finally:
+        STREAM_EVENT.clear()
         release_camera()
         print("リソースを解放しました")
\ No newline at end of file
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import "./loading.css";
 
 function App() {
@@ -9,6 +9,13 @@ function App() {
 	const [isLoading, setIsLoading] = useState(true);
 	const [backendConnected, setBackendConnected] = useState(false);
 	const [isSystemStarting, setIsSystemStarting] = useState(false);
+	const [objectDetectionLoading, setObjectDetectionLoading] = useState(false);
+	// 再試行など非同期処理の中からも最新のストリーミング状態を参照するためのref
+	const isStreamingRef = useRef(false);
+
+	useEffect(() => {
+		isStreamingRef.current = isStreaming;
+	}, [isStreaming]);
 
 	// バックエンドのベースURLを動的に決定する関数
 	const getBackendBaseUrl = () => {
@@ -106,6 +113,8 @@ function App() {
 
 	// 物体検出を有効化
 	const enableObjectDetection = async () => {
+		// モデル読み込み中はボタンを無効化し、再試行のループが重複しないようにする
+		setObjectDetectionLoading(true);
 		try {
 			const response = await fetch(`${getBackendBaseUrl()}/enable_object_detection`, {
 				method: "POST",
@@ -117,19 +126,27 @@ function App() {
 			if (response.ok) {
 				const data = await response.json();
 				if (data.status === "enabled") {
+					setObjectDetectionLoading(false);
 					setObjectDetectionEnabled(true);
-					// ストリーミング中ならURLを更新して物体検出結果を反映
-					if (isStreaming) {
+					// ストリーミング中ならURLを更新して物体検出結果を反映（読み込み待ちの間に開始された場合も含む）
+					if (isStreamingRef.current) {
 						updateStreamUrl();
 					}
+				} else if (data.status === "loading") {
+					// バックエンドでモデルを読み込み中の場合は、500ms待ってから再試行
+					console.log("物体検出モデルを読み込み中のため再試行します...");
+					setTimeout(enableObjectDetection, 500);
 				} else {
+					setObjectDetectionLoading(false);
 					alert(data.message || "物体検出有効化に失敗しました");
 				}
 			} else {
+				setObjectDetectionLoading(false);
 				alert("物体検出有効化に失敗しました");
 			}
 		} catch (error) {
 			console.error("物体検出有効化エラー:", error);
+			setObjectDetectionLoading(false);
 			alert("物体検出有効化に失敗しました");
 		}
 	};
@@ -299,17 +316,17 @@ function App() {
 				{/* 物体検出トグルボタン */}
 				<button
 					className={`px-6 py-3 rounded text-white font-medium transition-colors ${
-						!objectDetectionAvailable
+						!objectDetectionAvailable || objectDetectionLoading
 							? "bg-gray-500 cursor-not-allowed"
 							: objectDetectionEnabled
 							? "bg-green-600 hover:bg-green-700"
 							: "bg-gray-600 hover:bg-gray-700"
 					}`}
 					onClick={objectDetectionEnabled ? disableObjectDetection : enableObjectDetection}
-					disabled={!objectDetectionAvailable}
-					title={!objectDetectionAvailable ? "物体検出機能は利用できません" : objectDetectionEnabled ? "物体検出を無効化" : "物体検出を有効化"}
+					disabled={!objectDetectionAvailable || objectDetectionLoading}
+					title={!objectDetectionAvailable ? "物体検出機能は利用できません" : objectDetectionLoading ? "物体検出モデルを読み込み中です" : objectDetectionEnabled ? "物体検出を無効化" : "物体検出を有効化"}
 				>
-					物体検出 {objectDetectionEnabled ? "ON" : "OFF"}
+					物体検出 {objectDetectionLoading ? "読み込み中..." : objectDetectionEnabled ? "ON" : "OFF"}
 					{!objectDetectionAvailable && " (利用不可)"}
 				</button>
 				